@@ -0,0 +1,26 @@
+# backend/clients.py
+
+import httpx
+
+from config import OLLAMA_API_BASE_URL
+
+# Shared client for the Ollama API, reused across requests
+ollama_client = httpx.AsyncClient(
+    base_url=OLLAMA_API_BASE_URL,
+    timeout=5.0,  # Generation streams pass timeout=None per request
+    http2=True,
+    limits=httpx.Limits(max_keepalive_connections=64, max_connections=128),
+)
+
+# Shared client for the Google Custom Search API
+google_client = httpx.AsyncClient(
+    http2=True,
+    limits=httpx.Limits(max_keepalive_connections=32),
+)
+
+async def close_clients():
+    """
+    Closes the shared HTTP clients.
+    """
+    await ollama_client.aclose()
+    await google_client.aclose()
@@ -3,8 +3,10 @@
 import os
 from dotenv import load_dotenv
 
-# Load environment variables from .env file
-load_dotenv()
+# Load environment variables from .env file (once per process tree)
+if not os.getenv("_ENV_LOADED"):
+    load_dotenv()
+    os.environ["_ENV_LOADED"] = "1"
 
 # API Configuration
 OLLAMA_API_BASE_URL = os.getenv("OLLAMA_API_BASE_URL", "http://localhost:11434/api")
@@ -14,9 +16,16 @@ SEARCH_ENGINE_ID = os.getenv("GOOGLE_CUSTOM_SEARCH_ENGINE_ID")
 # Memory Configuration
 MEMORY_FILE = os.getenv("MEMORY_FILE", "memory.json")
 MAX_MEMORY_FILE_SIZE = 4 * 1024 * 1024 * 1024  # 4GB
+CHATS_DIR = os.getenv("CHATS_DIR", "chats")  # Per-chat conversation history files
+MAX_CHAT_FILE_SIZE = 16 * 1024 * 1024  # 16MB, history files are rotated past this
+MAX_HISTORY_MESSAGES = int(os.getenv("MAX_HISTORY_MESSAGES", "64"))  # Messages of history included in prompts
+MEMORY_FLUSH_INTERVAL = float(os.getenv("MEMORY_FLUSH_INTERVAL", "1.0"))  # Seconds between memory writes
 
 # FastAPI Configuration
 ALLOWED_ORIGINS = os.getenv("ALLOWED_ORIGINS", "http://localhost:5173").split(",")
 
+# Logging Configuration
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+
 # Model Preferences
 DEFAULT_MODEL = os.getenv("DEFAULT_MODEL", "Llama3.2:3B")
@@ -1,31 +1,38 @@
 # backend/main.py
 
-import os
-import re
-import json
 import asyncio
 import logging
-from typing import List, Dict, Any, Tuple
+import re
+from typing import Dict, Any, Iterable
 
+import ahocorasick
 import httpx
+import msgspec
 from fastapi import FastAPI, HTTPException
-from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
-from pydantic import BaseModel
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from starlette.middleware.gzip import DEFAULT_EXCLUDED_CONTENT_TYPES
 
 from config import ALLOWED_ORIGINS, DEFAULT_MODEL, OLLAMA_API_BASE_URL  # Ensure correct import
+from middleware import ASGICORSMiddleware
+from clients import ollama_client, close_clients
+from models import Message
 from memory import (
     load_memory,
-    save_memory,
+    schedule_save,
+    start_memory_flusher,
+    stop_memory_flusher,
     update_conversation_history,
+    load_recent_history,
     extract_memory_from_message,
     store_memory
 )
-from search import search_and_summarize
+from search import fetch_search_results, search_and_summarize
 from model_management import start_model
-from utils import get_logger
+from utils import configure_logging, get_logger, aiter_byte_lines, decode_ollama_chunk
 
 # Initialize Logger
+configure_logging()
 logger = get_logger(__name__)
 
 # Initialize FastAPI app
@@ -37,53 +44,93 @@ app = FastAPI(
 
 # CORS middleware configuration
 app.add_middleware(
-    CORSMiddleware,
+    ASGICORSMiddleware,
     allow_origins=ALLOWED_ORIGINS,  # e.g., ["http://localhost:5173"]
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
 )
 
+# Compress larger JSON responses (e.g., /models); the plain-text token streams
+# are excluded so GZip doesn't buffer their chunks
+app.add_middleware(
+    GZipMiddleware,
+    minimum_size=1024,
+    exclude_content_types=DEFAULT_EXCLUDED_CONTENT_TYPES + ("text/plain",),
+)
+
+@app.on_event("startup")
+async def startup():
+    start_memory_flusher()
+
+@app.on_event("shutdown")
+async def shutdown():
+    await stop_memory_flusher()
+    await close_clients()
+
 # ----------------------------
-# Pydantic Models
+# Message Patterns
 # ----------------------------
 
-class Message(BaseModel):
-    content: str          # User's message content
-    model: str            # Model name to use
-    history: List[Dict[str, Any]]   # List of past messages
-    chat_id: int          # Unique identifier for the chat
+# Define search keywords with broader coverage
+SEARCH_KEYWORDS = [
+    "search the internet for", "search the web for", "find", "look up",
+    "tell me about", "who is", "what is", "current weather in",
+    "today's weather in", "weather today in", "weather forecast for",
+    "latest news on", "news about", "information on", "details about"
+]
+
+# Single-pass matcher for the search keywords
+_KEYWORD_AUTOMATON = ahocorasick.Automaton()
+for _keyword in SEARCH_KEYWORDS:
+    _KEYWORD_AUTOMATON.add_word(_keyword, _keyword)
+_KEYWORD_AUTOMATON.make_automaton()
+
+_WHAT_NAME_RE = re.compile(r'\bwhat is my name\b')
+_QUERY_RE = re.compile(
+    "(" + "|".join(re.escape(keyword) for keyword in SEARCH_KEYWORDS) + ") (.+)",
+    re.I
+)
 
 # ----------------------------
 # Helper Functions
 # ----------------------------
 
-def construct_prompt(conversation_history: List[Dict[str, Any]], memory_store: Dict[str, Any], user_message: str) -> str:
+_SYSTEM_PROMPT_HEAD = (
+    "You are Hasko, a friendly and intelligent assistant. "
+    "Provide clear and concise answers. Only include code snippets when the user explicitly requests them. "
+    "When providing code, present it within triple backticks with the appropriate language specified.\n\n"
+)
+
+# Explicit instruction to avoid unnecessary code
+_SYSTEM_PROMPT_TAIL = (
+    "Please ensure that your responses do not contain code unless explicitly requested by the user.\n"
+    "Respond appropriately to the user's messages based on their content.\n\n"
+)
+
+def construct_prompt(conversation_history: Iterable[Dict[str, Any]], memory_store: Dict[str, Any], user_message: str) -> str:
     """
     Constructs the prompt to send to the LLM based on conversation history, memory store, and the latest user message.
     """
-    prompt = (
-        "You are Hasko, a friendly and intelligent assistant. "
-        "Provide clear and concise answers. Only include code snippets when the user explicitly requests them. "
-        "When providing code, present it within triple backticks with the appropriate language specified.\n\n"
-    )
+    parts = [_SYSTEM_PROMPT_HEAD]
     
     # Include user-specific information from memory_store
     if "user_name" in memory_store:
-        prompt += f"User's Name: {memory_store['user_name']}\n"
-    
-    for message in conversation_history:
-        role = "User" if message["role"] == "user" else "Hasko"
-        prompt += f"{role}: {message['content']}\n"
+        parts.append(f"User's Name: {memory_store['user_name']}\n")
     
-    # Explicit instruction to avoid unnecessary code
-    prompt += (
-        "Please ensure that your responses do not contain code unless explicitly requested by the user.\n"
-        "Respond appropriately to the user's messages based on their content.\n\n"
+    parts.extend(
+        f"{'User' if message['role'] == 'user' else 'Hasko'}: {message['content']}\n"
+        for message in conversation_history
     )
     
-    prompt += f"User: {user_message}\nHasko:"
-    return prompt
+    parts.append(_SYSTEM_PROMPT_TAIL)
+    parts.append(f"User: {user_message}\nHasko:")
+    return "".join(parts)
+
+def _retrieve_exception(task: asyncio.Task):
+    """
+    Marks a prefetch task's exception as retrieved. The search stream, if it
+    ever starts, awaits the task and reports the error itself.
+    """
+    if not task.cancelled():
+        task.exception()
 
 # ----------------------------
 # API Endpoints
@@ -99,121 +146,124 @@ async def send_message(msg: Message):
 
     logger.info(f"Received message: '{msg.content}' | Model: '{model_name}' | Chat ID: {msg.chat_id}")
 
+    text = msg.content.lower()
+
+    # Extract new memory from user message
+    new_memory, is_change_request = extract_memory_from_message({'content': msg.content, 'isUser': True})
+
+    # Check if the message requires an internet search
+    search_query = None
+    if (
+        not is_change_request
+        and not _WHAT_NAME_RE.search(text)
+        and next(_KEYWORD_AUTOMATON.iter(text), None) is not None
+    ):
+        # Extract the search query using regex
+        query = _QUERY_RE.search(text)
+        if query:
+            search_query = query.group(2).strip()
+        else:
+            logger.warning(f"Unable to extract search query from message: '{msg.content}'")
+
+    # Fetch search results while the model starts
+    search_results = None
+    if search_query is not None:
+        search_results = asyncio.create_task(fetch_search_results(search_query))
+        # The client may disconnect before the stream awaits the task
+        search_results.add_done_callback(_retrieve_exception)
+
     # Start the model if not running
-    if not start_model(model_name):
+    if not await start_model(model_name):
+        if search_results is not None:
+            search_results.cancel()
         logger.error(f"Failed to start or connect to model '{model_name}'")
         raise HTTPException(status_code=500, detail=f"Failed to start or connect to model '{model_name}'")
 
     # Load existing memory
-    memory = load_memory()
+    memory = await load_memory()
     chat_id_str = str(msg.chat_id)
 
     # Initialize chat if it doesn't exist
-    if "chats" not in memory:
-        memory["chats"] = {}
-    
-    if chat_id_str not in memory["chats"]:
-        memory["chats"][chat_id_str] = {"conversation_history": [], "memory_store": {}}
-    
-    chat_history = memory["chats"][chat_id_str]["conversation_history"]
-    memory_store = memory["chats"][chat_id_str].get("memory_store", {})
-
-    # Extract new memory from user message
-    new_memory, is_change_request = extract_memory_from_message({'content': msg.content, 'isUser': True})
+    chat = memory.setdefault("chats", {}).setdefault(chat_id_str, {"memory_store": {}})
+    memory_store = chat.setdefault("memory_store", {})
 
     # Handle change requests (e.g., updating user information)
     if is_change_request:
-        memory["chats"][chat_id_str]["memory_store"].update(new_memory)
+        memory_store.update(new_memory)
         response_message = "Are you sure you want to update this information? Please reply with 'Yes' or 'No'."
-        update_conversation_history(memory, chat_id_str, "hasko", response_message)
-        save_memory(memory)
-        return StreamingResponse(iter([response_message]), media_type="text/plain")
+        await update_conversation_history(chat_id_str, "hasko", response_message)
+        schedule_save(memory)
+        return PlainTextResponse(response_message)
 
     # Update memory with new information if any
     if new_memory:
-        store_memory(memory["chats"][chat_id_str], new_memory)
-        user_name = memory["chats"][chat_id_str]["memory_store"].get("user_name", "there")
+        store_memory(chat, new_memory)
+        user_name = memory_store.get("user_name", "there")
         response_greeting = f"Got it, {user_name}!"
-        update_conversation_history(memory, chat_id_str, "hasko", response_greeting)
-        save_memory(memory)
+        await update_conversation_history(chat_id_str, "hasko", response_greeting)
+        schedule_save(memory)
 
     # Special handling for "what is my name" question
-    if re.search(r'\bwhat is my name\b', msg.content.lower()):
+    if _WHAT_NAME_RE.search(text):
         if "user_name" in memory_store:
             response_message = f"Your name is {memory_store['user_name']}."
-            update_conversation_history(memory, chat_id_str, "hasko", response_message)
-            save_memory(memory)
-            return StreamingResponse(iter([response_message]), media_type="text/plain")
+            await update_conversation_history(chat_id_str, "hasko", response_message)
+            return PlainTextResponse(response_message)
         else:
             response_message = "I don't know your name yet. Could you please tell me your name?"
-            update_conversation_history(memory, chat_id_str, "hasko", response_message)
-            save_memory(memory)
-            return StreamingResponse(iter([response_message]), media_type="text/plain")
-
-    # Define search keywords with broader coverage
-    search_keywords = [
-        "search the internet for", "search the web for", "find", "look up",
-        "tell me about", "who is", "what is", "current weather in",
-        "today's weather in", "weather today in", "weather forecast for",
-        "latest news on", "news about", "information on", "details about"
-    ]
-
-    # Check if the message requires an internet search
-    if any(keyword in msg.content.lower() for keyword in search_keywords):
-        # Extract the search query using regex
-        query = re.search(
-            r"(search the internet for|search the web for|find|look up|tell me about|who is|what is|current weather in|today's weather in|weather today in|weather forecast for|latest news on|news about|information on|details about) (.+)",
-            msg.content.lower()
-        )
-        if query:
-            search_query = query.group(2).strip()
-            logger.info(f"Performing search for query: '{search_query}'")
-            web_content = await search_and_summarize(search_query, model_name)
-            logger.info(f"Search and summarization completed. Response: '{web_content}'")
-            # Only wrap in code block if web_content contains code
-            if re.search(r'```(\w+)?\n([\s\S]*?)```', web_content):
-                response_message = f"Here's what I found:\n\n{web_content}"
-            else:
-                response_message = f"Here's what I found:\n\n{web_content}"
-            update_conversation_history(memory, chat_id_str, "hasko", response_message)
-            save_memory(memory)
-            return StreamingResponse(iter([response_message]), media_type="text/plain")
-        else:
-            logger.warning(f"Unable to extract search query from message: '{msg.content}'")
+            await update_conversation_history(chat_id_str, "hasko", response_message)
+            return PlainTextResponse(response_message)
+
+    if search_query is not None:
+        logger.info(f"Performing search for query: '{search_query}'")
+
+        # Stream the summary as it is generated, then record the reply
+        async def stream_search():
+            parts = ["Here's what I found:\n\n"]
+            try:
+                yield parts[0]
+                async for chunk in search_and_summarize(search_query, model_name, search_results):
+                    parts.append(chunk)
+                    yield chunk
+            finally:
+                # Also runs when the client disconnects mid-stream; shield the write from cancellation
+                response_message = "".join(parts)
+                logger.info(f"Search and summarization completed. Response: '{response_message}'")
+                await asyncio.shield(update_conversation_history(chat_id_str, "hasko", response_message))
+
+        return StreamingResponse(stream_search(), media_type="text/plain")
 
     # If no search is required, proceed to construct prompt and get response from LLM
+    chat_history = await load_recent_history(chat_id_str)
     prompt = construct_prompt(chat_history, memory_store, msg.content)
     logger.info(f"Constructed prompt for LLM: '{prompt}'")
 
-    # Add user message to memory
-    update_conversation_history(memory, chat_id_str, "user", msg.content)
-    save_memory(memory)
+    # Add user message to the conversation history
+    await update_conversation_history(chat_id_str, "user", msg.content)
 
     # Stream response from LLM
     async def stream_response():
         try:
-            async with httpx.AsyncClient(timeout=None) as client:
-                async with client.stream(
-                    "POST",
-                    f"{OLLAMA_API_BASE_URL}/generate",
-                    json={"model": model_name, "prompt": prompt, "stream": True},
-                ) as response:
-                    response.raise_for_status()
-                    llm_response = ""
-                    async for line in response.aiter_lines():
-                        if line:
-                            try:
-                                data = json.loads(line)
-                                chunk = data.get("response", "")
-                                if chunk:
-                                    llm_response += chunk
-                                    logger.debug(f"Received chunk from LLM: '{chunk}'")
-                                    yield chunk
-                                    await asyncio.sleep(0)
-                            except json.JSONDecodeError:
-                                logger.error(f"Failed to decode JSON line: '{line}'")
+            async with ollama_client.stream(
+                "POST",
+                "/generate",
+                json={"model": model_name, "prompt": prompt, "stream": True},
+                timeout=None,
+            ) as response:
+                response.raise_for_status()
+                parts = []
+                async for line in aiter_byte_lines(response):
+                    try:
+                        chunk = decode_ollama_chunk(line).response
+                        if chunk:
+                            parts.append(chunk)
+                            logger.debug("Received chunk from LLM: %r", chunk)
+                            yield chunk
+                    except msgspec.DecodeError:
+                        logger.error(f"Failed to decode JSON line: '{line}'")
             # After streaming, ensure the entire response is captured
-            logger.debug(f"Full LLM Response: '{llm_response}'")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Full LLM Response: %r", "".join(parts))
         except httpx.HTTPError as http_err:
             logger.error(f"HTTP error during LLM communication: {http_err}")
             yield "I encountered an error while processing your request."
@@ -234,9 +284,8 @@ async def list_models():
     """
     try:
         logger.info(f"Fetching models from Ollama API at '{OLLAMA_API_BASE_URL}/tags'")
-        async with httpx.AsyncClient() as client:
-            response = await client.get(f"{OLLAMA_API_BASE_URL}/tags")
-            response.raise_for_status()
+        response = await ollama_client.get("/tags")
+        response.raise_for_status()
         models_data = response.json().get("models", [])
         model_names = [model["name"] for model in models_data]
         logger.info(f"Retrieved models: {model_names}")
@@ -262,4 +311,11 @@ async def root():
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="127.0.0.1", port=8000)
+    uvicorn.run(
+        "main:app",
+        host="127.0.0.1",
+        port=8000,
+        loop="auto",  # uvloop when installed (not available on Windows)
+        http="auto",  # httptools when installed
+        workers=1,
+    )
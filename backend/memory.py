@@ -1,78 +1,323 @@
 # backend/memory.py
 
 import os
-import json
-import logging
+import asyncio
 import re
-from typing import Dict, Any, Tuple
+import threading
+from collections import deque
+from typing import Deque, Dict, Any, List, Optional, Tuple
 
-from config import MEMORY_FILE, MAX_MEMORY_FILE_SIZE
+import aiofiles
+import orjson
+
+from config import (
+    MEMORY_FILE,
+    MAX_MEMORY_FILE_SIZE,
+    MEMORY_FLUSH_INTERVAL,
+    CHATS_DIR,
+    MAX_CHAT_FILE_SIZE,
+    MAX_HISTORY_MESSAGES,
+)
+from utils import get_logger
 
 # Configure logging
-logger = logging.getLogger(__name__)
+logger = get_logger(__name__)
+
+HISTORY_READ_BLOCK = 64 * 1024  # Bytes read per step when loading recent history
+
+_NAME_RE = re.compile(r"my name is ([a-zA-Z\s]+)")
+
+# Parsed memory cached by the file's mtime
+_cache = {"mtime": -1, "data": None, "lock": threading.Lock()}
+_load_lock = asyncio.Lock()
 
-def load_memory() -> Dict[str, Any]:
+# Debounced writes: the latest memory to persist and the background flusher state
+_pending: Optional[Dict[str, Any]] = None
+_pending_version = 0  # Bumped on every schedule_save()
+_saved_version = 0  # Last _pending_version successfully written
+_dirty: Optional[asyncio.Event] = None
+_flush_task: Optional[asyncio.Task] = None
+
+def _cached_memory() -> Tuple[Optional[Dict[str, Any]], Optional[os.stat_result]]:
+    """
+    Returns the in-process memory if it is still current, otherwise None and the file's stat.
+    """
+    try:
+        st = os.stat(MEMORY_FILE)
+    except FileNotFoundError:
+        # Nothing flushed yet; keep handing out the same in-process memory
+        with _cache["lock"]:
+            if _cache["data"] is None:
+                _cache["data"] = {"memory_store": {}, "chats": {}}
+            return _cache["data"], None
+    except Exception as e:
+        logger.error(f"Unexpected error loading memory: {e}")
+        return {"memory_store": {}, "chats": {}}, None
+
+    if st.st_mtime_ns == _cache["mtime"]:
+        return _cache["data"], st
+    return None, st
+
+async def load_memory() -> Dict[str, Any]:
     """
     Loads the memory from the MEMORY_FILE.
+    Returns the cached copy if the file hasn't changed since the last load or save.
     Initializes an empty memory if file doesn't exist or is corrupted.
     """
-    if os.path.exists(MEMORY_FILE):
+    memory, st = _cached_memory()
+    if memory is not None:
+        return memory
+
+    # Serialize cold loads so concurrent requests share one dict instead of
+    # each parsing their own and overwriting the other's changes on save
+    async with _load_lock:
+        memory, st = _cached_memory()
+        if memory is not None:
+            return memory
+
         try:
-            if os.path.getsize(MEMORY_FILE) > MAX_MEMORY_FILE_SIZE:
-                logger.error("Memory file exceeds maximum allowed size. Initializing empty memory.")
-                return {"memory_store": {}, "chats": {}}
-            with open(MEMORY_FILE, "r") as f:
-                memory = json.load(f)
+            async with aiofiles.open(MEMORY_FILE, "rb") as f:
+                data = await f.read()
+            memory = orjson.loads(data)
             logger.info("Memory loaded successfully.")
             if "memory_store" not in memory:
                 memory["memory_store"] = {}
             if "chats" not in memory:
                 memory["chats"] = {}
+            if await _migrate_conversation_history(memory):
+                schedule_save(memory)
+            if st.st_size > MAX_MEMORY_FILE_SIZE:
+                logger.warning("Memory file exceeds maximum allowed size. Dropping oldest chats.")
+                _truncate_memory(memory)
+                await save_memory(memory)  # Also refreshes the cache
+                return memory
+            with _cache["lock"]:
+                _cache["mtime"] = st.st_mtime_ns
+                _cache["data"] = memory
             return memory
-        except json.JSONDecodeError:
+        except orjson.JSONDecodeError:
             logger.error("Memory file is corrupted. Initializing empty memory.")
         except Exception as e:
             logger.error(f"Unexpected error loading memory: {e}")
-    return {"memory_store": {}, "chats": {}}
+        return {"memory_store": {}, "chats": {}}
 
-def save_memory(memory: Dict[str, Any]):
+async def save_memory(memory: Dict[str, Any]) -> bool:
     """
-    Saves the memory to the MEMORY_FILE.
+    Saves the memory to the MEMORY_FILE and refreshes the in-process cache.
+    Writes to a temporary file first so an interrupted save never truncates the memory file.
+    Returns True on success.
     """
+    tmp_file = f"{MEMORY_FILE}.tmp"
     try:
-        with open(MEMORY_FILE, "w") as f:
-            json.dump(memory, f, indent=4)
+        data = orjson.dumps(memory, option=orjson.OPT_INDENT_2)
+        async with aiofiles.open(tmp_file, "wb") as f:
+            await f.write(data)
+        os.replace(tmp_file, MEMORY_FILE)
+        with _cache["lock"]:
+            _cache["mtime"] = os.stat(MEMORY_FILE).st_mtime_ns
+            _cache["data"] = memory
         logger.info("Memory saved successfully.")
+        return True
     except Exception as e:
         logger.error(f"Failed to save memory: {e}")
+        return False
+
+def _indented_size(obj: Any) -> int:
+    # Size as written by save_memory
+    return len(orjson.dumps(obj, option=orjson.OPT_INDENT_2))
 
-def update_conversation_history(memory: dict, chat_id: str, role: str, content: str):
+def _truncate_memory(memory: Dict[str, Any]):
     """
-    Updates the conversation history in memory.
+    Drops the oldest chats, along with their history files, until the memory
+    as written by save_memory fits within MAX_MEMORY_FILE_SIZE.
+    """
+    chats = memory["chats"]
+    empty_size = _indented_size({"chats": {}})
+    # Chat IDs are timestamps, so shorter/lexically smaller IDs are older.
+    # Each chat's share is its indented "id": {...} entry plus the ",\n    " separator.
+    sizes = sorted(
+        (
+            (chat_id, _indented_size({"chats": {chat_id: chat}}) - empty_size - 2)
+            for chat_id, chat in chats.items()
+        ),
+        key=lambda item: (len(item[0]), item[0])
+    )
+    total = _indented_size(memory)
+    for chat_id, size in sizes:
+        if total <= MAX_MEMORY_FILE_SIZE:
+            break
+        del chats[chat_id]
+        total -= size
+        path = _chat_file(chat_id)
+        for history_file in (path, f"{path}.1"):
+            try:
+                os.remove(history_file)
+            except FileNotFoundError:
+                pass
+        logger.info(f"Dropped chat {chat_id} from memory to stay under the size limit.")
+
+def schedule_save(memory: Dict[str, Any]):
+    """
+    Marks the memory as changed so the background flusher writes it to disk.
+    """
+    global _pending, _pending_version
+    _pending = memory
+    _pending_version += 1
+    if _dirty is not None:
+        _dirty.set()
+
+async def _flush_pending() -> bool:
+    """
+    Writes the pending memory if it changed since the last successful save.
+    Returns False if the save failed.
+    """
+    global _saved_version
+    version = _pending_version
+    if version == _saved_version:
+        return True
+    if not await save_memory(_pending):
+        return False
+    _saved_version = version
+    return True
+
+async def _flusher():
+    """
+    Writes pending memory to disk at most once every MEMORY_FLUSH_INTERVAL seconds.
+    """
+    while True:
+        await _dirty.wait()
+        await asyncio.sleep(MEMORY_FLUSH_INTERVAL)
+        _dirty.clear()
+        if not await _flush_pending():
+            _dirty.set()  # Retry on the next interval
+
+def start_memory_flusher():
     """
-    if "chats" not in memory:
-        memory["chats"] = {}
-    if chat_id not in memory["chats"]:
-        memory["chats"][chat_id] = {"conversation_history": [], "memory_store": {}}
-    if "conversation_history" not in memory["chats"][chat_id]:
-        memory["chats"][chat_id]["conversation_history"] = []
-    memory["chats"][chat_id]["conversation_history"].append({"role": role, "content": content})
+    Starts the background task that persists scheduled memory saves.
+    """
+    global _dirty, _flush_task
+    _dirty = asyncio.Event()
+    if _pending_version != _saved_version:
+        _dirty.set()
+    _flush_task = asyncio.create_task(_flusher())
+
+async def stop_memory_flusher():
+    """
+    Stops the background flusher and writes any pending memory to disk.
+    """
+    global _flush_task
+    if _flush_task is not None:
+        _flush_task.cancel()
+        try:
+            await _flush_task
+        except asyncio.CancelledError:
+            pass
+        _flush_task = None
+    # Covers saves that were still pending or were cancelled mid-write
+    await _flush_pending()
+
+def _chat_file(chat_id: str) -> str:
+    return os.path.join(CHATS_DIR, f"{chat_id}.jsonl")
+
+def _encode_message(role: str, content: str) -> bytes:
+    return orjson.dumps({"role": role, "content": content}) + b"\n"
+
+async def _migrate_conversation_history(memory: Dict[str, Any]) -> bool:
+    """
+    Moves conversation histories stored in the memory file into per-chat history files.
+    Returns True if the memory was changed.
+    """
+    migrated = False
+    for chat_id, chat in memory["chats"].items():
+        history = chat.pop("conversation_history", None)
+        if history is None:
+            continue
+        migrated = True
+        path = _chat_file(chat_id)
+        if history and not os.path.exists(path):
+            os.makedirs(CHATS_DIR, exist_ok=True)
+            async with aiofiles.open(path, "wb") as f:
+                await f.write(b"".join(_encode_message(m["role"], m["content"]) for m in history))
+            logger.info(f"Migrated conversation history for chat {chat_id}.")
+    return migrated
+
+async def update_conversation_history(chat_id: str, role: str, content: str):
+    """
+    Appends a message to the chat's conversation history file.
+    Rotates the file once it exceeds MAX_CHAT_FILE_SIZE.
+    """
+    path = _chat_file(chat_id)
+    try:
+        os.makedirs(CHATS_DIR, exist_ok=True)
+        if os.path.exists(path) and os.path.getsize(path) > MAX_CHAT_FILE_SIZE:
+            os.replace(path, f"{path}.1")
+            logger.info(f"Rotated conversation history for chat {chat_id}.")
+        async with aiofiles.open(path, "ab") as f:
+            await f.write(_encode_message(role, content))
+    except Exception as e:
+        logger.error(f"Failed to update conversation history: {e}")
+
+async def _read_tail_lines(path: str, count: int) -> List[bytes]:
+    """
+    Returns up to the last `count` non-empty lines of a file.
+    Reads the file backwards from the end so long files aren't read in full.
+    """
+    blocks = []
+    newlines = 0
+    try:
+        async with aiofiles.open(path, "rb") as f:
+            pos = await f.seek(0, os.SEEK_END)
+            # One newline more than lines wanted so the oldest kept line is complete
+            while pos > 0 and newlines <= count:
+                size = min(HISTORY_READ_BLOCK, pos)
+                pos -= size
+                await f.seek(pos)
+                block = await f.read(size)
+                blocks.append(block)
+                newlines += block.count(b"\n")
+    except FileNotFoundError:
+        return []
+
+    lines = b"".join(reversed(blocks)).split(b"\n")
+    if pos > 0:
+        lines = lines[1:]  # Partial line cut by the last seek
+    lines = [line for line in lines if line.strip()]
+    return lines[-count:]
+
+async def load_recent_history(chat_id: str) -> Deque[Dict[str, Any]]:
+    """
+    Returns the last MAX_HISTORY_MESSAGES messages of a chat's conversation history.
+    Falls back to the rotated file for the older messages right after a rotation.
+    """
+    path = _chat_file(chat_id)
+    lines = await _read_tail_lines(path, MAX_HISTORY_MESSAGES)
+    if len(lines) < MAX_HISTORY_MESSAGES:
+        lines = await _read_tail_lines(f"{path}.1", MAX_HISTORY_MESSAGES - len(lines)) + lines
+
+    history = deque(maxlen=MAX_HISTORY_MESSAGES)
+    for line in lines:
+        try:
+            history.append(orjson.loads(line))
+        except orjson.JSONDecodeError:
+            logger.error(f"Skipping corrupted history line in chat {chat_id}.")
+    return history
 
 def store_memory(chat_memory: dict, extracted_info: Dict[str, str]):
     """
     Stores extracted information into the memory_store within a specific chat.
     Prevents duplicates by checking existing entries.
     """
+    memory_store = chat_memory["memory_store"]
     for key, value in extracted_info.items():
-        if key not in chat_memory["memory_store"]:
-            chat_memory["memory_store"][key] = value
+        existing = memory_store.get(key)
+        if existing is None:
+            memory_store[key] = value
             logger.info(f"Stored new memory - {key}: {value}")
+        elif existing != value:
+            logger.info(f"Updating memory - {key}: {value}")
+            memory_store[key] = value
         else:
-            if chat_memory["memory_store"][key] != value:
-                logger.info(f"Updating memory - {key}: {value}")
-                chat_memory["memory_store"][key] = value
-            else:
-                logger.debug(f"Memory '{key}' already up-to-date. Skipping duplicate.")
+            logger.debug(f"Memory '{key}' already up-to-date. Skipping duplicate.")
 
 def extract_memory_from_message(message: Dict[str, Any]) -> Tuple[Dict[str, str], bool]:
     """
@@ -84,7 +329,7 @@ def extract_memory_from_message(message: Dict[str, Any]) -> Tuple[Dict[str, str]
     text = message['content'].lower()
 
     # Extract user name
-    name_match = re.search(r"my name is ([a-zA-Z\s]+)", text)
+    name_match = _NAME_RE.search(text)
     if name_match:
         user_name = name_match.group(1).strip().title()
 
@@ -0,0 +1,91 @@
+# backend/middleware.py
+
+from typing import Iterable
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+
+class ASGICORSMiddleware:
+    """
+    Pure ASGI CORS middleware.
+    Injects the CORS headers directly into the `http.response.start` message
+    and answers preflight requests without calling the wrapped application.
+    An origin of "*" allows every origin; the request's origin is echoed back
+    since credentials are allowed.
+    """
+
+    def __init__(self, app: ASGIApp, allow_origins: Iterable[str]):
+        self.app = app
+        self._origins = frozenset(allow_origins)
+        self._allow_all_origins = "*" in self._origins
+        self._origins_bytes = {o.encode("latin-1"): True for o in self._origins}
+        self._static_headers = [
+            (b"access-control-allow-credentials", b"true"),
+            (b"vary", b"Origin"),
+        ]
+        self._allow_methods = b"GET, POST, PUT, DELETE, OPTIONS, PATCH"
+
+        # Preflight responses only differ in the echoed origin and headers, so build the rest once
+        self._preflight_headers = self._static_headers + [
+            (b"access-control-allow-methods", self._allow_methods),
+            (b"access-control-max-age", b"600"),
+            (b"content-type", b"text/plain; charset=utf-8"),
+            (b"content-length", b"2"),
+        ]
+        self._preflight_rejected_body = b"Disallowed CORS origin"
+        self._preflight_rejected_headers = self._static_headers + [
+            (b"content-type", b"text/plain; charset=utf-8"),
+            (b"content-length", str(len(self._preflight_rejected_body)).encode("latin-1")),
+        ]
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        origin = None
+        request_method = None
+        request_headers = None
+        for name, value in scope["headers"]:
+            if name == b"origin":
+                origin = value
+            elif name == b"access-control-request-method":
+                request_method = value
+            elif name == b"access-control-request-headers":
+                request_headers = value
+
+        if origin is None:
+            await self.app(scope, receive, send)
+            return
+
+        allowed = self._allow_all_origins or origin in self._origins_bytes
+
+        # Preflight request: answer directly
+        if scope["method"] == "OPTIONS" and request_method is not None:
+            if allowed:
+                headers = self._preflight_headers + [(b"access-control-allow-origin", origin)]
+                if request_headers is not None:
+                    # A literal "*" isn't honoured with credentials, so allow exactly what was asked for
+                    headers.append((b"access-control-allow-headers", request_headers))
+                await send({"type": "http.response.start", "status": 200, "headers": headers})
+                await send({"type": "http.response.body", "body": b"OK"})
+            else:
+                await send({
+                    "type": "http.response.start",
+                    "status": 400,
+                    "headers": self._preflight_rejected_headers,
+                })
+                await send({"type": "http.response.body", "body": self._preflight_rejected_body})
+            return
+
+        async def send_with_cors(message: Message):
+            if message["type"] == "http.response.start":
+                headers = message.setdefault("headers", [])
+                if not isinstance(headers, list):
+                    headers = message["headers"] = list(headers)
+                headers.extend(self._static_headers)
+                if allowed:
+                    headers.append((b"access-control-allow-origin", origin))
+            await send(message)
+
+        await self.app(scope, receive, send_with_cors)
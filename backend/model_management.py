@@ -1,35 +1,65 @@
 # backend/model_management.py
 
+import asyncio
 import subprocess
 import time
 import logging
+from typing import Dict, Tuple
 
+from clients import ollama_client
 from utils import get_logger
 
 logger = get_logger(__name__)
 
-def is_model_running(model_name: str) -> bool:
+RUNNING_CACHE_TTL = 30  # Seconds a positive "model is running" check stays valid
+START_TIMEOUT = 10  # Seconds to wait for a started model to show up in /ps
+START_POLL_INTERVAL = 0.1
+
+# Model name -> (is_running, deadline)
+_running: Dict[str, Tuple[bool, float]] = {}
+
+# Model name -> lock serializing cold starts so each model is spawned once
+_start_locks: Dict[str, asyncio.Lock] = {}
+
+async def is_model_running(model_name: str) -> bool:
     """
     Checks if the specified model is currently running.
     """
+    cached = _running.get(model_name)
+    if cached is not None and cached[1] > time.monotonic():
+        return cached[0]
+
     try:
-        result = subprocess.run(
-            ["ollama", "ps"],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
-        )
-        logger.debug(f"Ollama 'ps' output: {result.stdout}")
-        return model_name in result.stdout
+        response = await ollama_client.get("/ps")
+        response.raise_for_status()
+        models = response.json().get("models", [])
+        logger.debug(f"Ollama '/ps' models: {models}")
+        running = any(model_name in model.get("name", "") for model in models)
     except Exception as e:
         logger.error(f"Error checking model status: {e}")
         return False
 
-def start_model(model_name: str) -> bool:
+    if running:
+        _running[model_name] = (True, time.monotonic() + RUNNING_CACHE_TTL)
+    else:
+        _running.pop(model_name, None)
+    return running
+
+async def start_model(model_name: str) -> bool:
     """
     Starts the specified model if it's not already running.
+    Concurrent calls for the same model wait for a single start attempt.
     """
-    if not is_model_running(model_name):
+    if await is_model_running(model_name):
+        logger.info(f"Model '{model_name}' is already running.")
+        return True
+
+    lock = _start_locks.setdefault(model_name, asyncio.Lock())
+    async with lock:
+        # Another request may have started the model while we waited
+        if await is_model_running(model_name):
+            logger.info(f"Model '{model_name}' is already running.")
+            return True
         try:
             logger.info(f"Attempting to start model '{model_name}'")
             subprocess.Popen(
@@ -38,16 +68,16 @@ def start_model(model_name: str) -> bool:
                 stderr=subprocess.PIPE
             )
             logger.info(f"Starting model '{model_name}'...")
-            time.sleep(5)  # Wait for the model to initialize
-            if is_model_running(model_name):
-                logger.info(f"Model '{model_name}' started successfully.")
-                return True
-            else:
-                logger.error(f"Model '{model_name}' failed to start.")
-                return False
+            # Poll until the model is loaded instead of sleeping a fixed time
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + START_TIMEOUT
+            while loop.time() < deadline:
+                if await is_model_running(model_name):
+                    logger.info(f"Model '{model_name}' started successfully.")
+                    return True
+                await asyncio.sleep(START_POLL_INTERVAL)
+            logger.error(f"Model '{model_name}' failed to start.")
+            return False
         except Exception as e:
             logger.error(f"Failed to start model '{model_name}': {e}")
             return False
-    else:
-        logger.info(f"Model '{model_name}' is already running.")
-        return True
@@ -1,10 +1,12 @@
 # backend/models.py
 
-from pydantic import BaseModel
-from typing import List, Dict, Any
+from pydantic import BaseModel, ConfigDict
+from typing import List, Any
 
 class Message(BaseModel):
+    model_config = ConfigDict(extra='ignore')
+
     content: str          # User's message content
     model: str            # Model name to use
-    history: List[Dict[str, Any]]   # List of past messages
+    history: List[Any]    # List of past messages (not validated per item; unused by the backend)
     chat_id: int          # Unique identifier for the chat
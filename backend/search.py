@@ -1,78 +1,140 @@
 # backend/search.py
 
-import json
+import io
 import logging
+import time
+from collections import OrderedDict
+from itertools import islice
 import httpx
-import asyncio
-from typing import Optional
+import ijson
+import msgspec
+import orjson
+from typing import AsyncIterator, Awaitable, List, Optional, Tuple
 
-from config import GOOGLE_API_KEY, SEARCH_ENGINE_ID, OLLAMA_API_BASE_URL
-from utils import get_logger
+from clients import google_client, ollama_client
+from config import GOOGLE_API_KEY, SEARCH_ENGINE_ID
+from utils import get_logger, aiter_byte_lines, decode_ollama_chunk
 
 logger = get_logger(__name__)
 
-async def search_and_summarize(query: str, model_name: str) -> str:
+# Search settings are fixed for the lifetime of the process
+GOOGLE_SEARCH_URL = "https://www.googleapis.com/customsearch/v1"
+_BASE_SEARCH_PARAMS = {"key": GOOGLE_API_KEY, "cx": SEARCH_ENGINE_ID}
+
+# Static parts of the summarization prompt
+_PROMPT_HEAD = "You are Hasko, a helpful AI assistant. Summarize the following information in a clear and concise way:\n"
+_PROMPT_TAIL = "\n\nSummary:"
+_JSON_HEADERS = {"content-type": "application/json"}
+
+MAX_SEARCH_RESULTS = 10  # Results requested per query by the Custom Search API
+SEARCH_CACHE_SIZE = 1024  # Maximum number of cached queries
+SEARCH_CACHE_TTL = 600  # Seconds a cached search result stays valid
+
+# Query -> (snippets, deadline), least recently used first
+_search_cache: "OrderedDict[str, Tuple[List[str], float]]" = OrderedDict()
+
+def _extract_snippets(content: bytes) -> List[str]:
+    """
+    Extracts the result snippets from a Google Custom Search response
+    without building the rest of the document.
+    """
+    snippets = ijson.items(io.BytesIO(content), 'items.item.snippet')
+    return list(islice(snippets, MAX_SEARCH_RESULTS))
+
+async def fetch_search_results(query: str) -> List[str]:
+    """
+    Performs a Google Custom Search for the given query and returns the result snippets.
+    Repeated queries are served from an in-process TTL cache.
+    """
+    cached = _search_cache.get(query)
+    if cached is not None:
+        if cached[1] > time.monotonic():
+            _search_cache.move_to_end(query)
+            logger.debug("Using cached search results for query: %r", query)
+            return cached[0]
+        del _search_cache[query]
+
+    params = {**_BASE_SEARCH_PARAMS, "q": query}
+    response = await google_client.get(GOOGLE_SEARCH_URL, params=params)
+    response.raise_for_status()
+    snippets = _extract_snippets(response.content)
+
+    _search_cache[query] = (snippets, time.monotonic() + SEARCH_CACHE_TTL)
+    if len(_search_cache) > SEARCH_CACHE_SIZE:
+        _search_cache.popitem(last=False)
+    return snippets
+
+async def search_and_summarize(
+    query: str,
+    model_name: str,
+    search_results: Optional[Awaitable[List[str]]] = None
+) -> AsyncIterator[str]:
     """
     Performs a Google Custom Search for the given query and summarizes the results using the LLM.
-    Returns the summarized information.
+    `search_results` may be an already started fetch_search_results() call for the query.
+    Yields the summary in chunks as the LLM produces them.
     """
-    logger.info(f"Starting search for query: '{query}' using model: '{model_name}'")
+    logger.info("Starting search for query: %r using model: %r", query, model_name)
     try:
-        # Perform Google Custom Search
-        search_url = "https://www.googleapis.com/customsearch/v1"
-        params = {
-            "key": GOOGLE_API_KEY,
-            "cx": SEARCH_ENGINE_ID,
-            "q": query,
-        }
-        async with httpx.AsyncClient() as client:
-            response = await client.get(search_url, params=params)
-            response.raise_for_status()
-            search_results = response.json()
+        # Perform Google Custom Search unless the caller already started it
+        if search_results is None:
+            search_results = fetch_search_results(query)
+        results = await search_results
 
-        if "items" not in search_results:
+        if not results:
             logger.warning("No search results found.")
-            return "I couldn't find any information related to your query."
+            yield "I couldn't find any information related to your query."
+            return
 
         # Extract snippets from search results
-        snippets = [item.get('snippet', '') for item in search_results.get('items', [])]
-        combined_snippets = ' '.join(snippets)
         max_length = 1000  # Limit length to avoid overwhelming the LLM
-        combined_snippets = combined_snippets[:max_length]
+        snippets, total = [], 0
+        for snippet in results:
+            snippets.append(snippet)
+            total += len(snippet) + 1
+            if total >= max_length:
+                break
+        combined_snippets = ' '.join(snippets)[:max_length]
 
-        logger.debug(f"Combined snippets for summarization: '{combined_snippets}'")
+        logger.debug("Combined snippets for summarization: %r", combined_snippets)
 
-        # Prepare the prompt for summarization
-        summary_prompt = (
-            f"You are Hasko, a helpful AI assistant. Summarize the following information in a clear and concise way:\n{combined_snippets}\n\nSummary:"
-        )
+        # Prepare the summarization request body
+        body = orjson.dumps({
+            "model": model_name,
+            "prompt": _PROMPT_HEAD + combined_snippets + _PROMPT_TAIL,
+            "stream": True,
+        })
 
         # Send the summarization request to Ollama's LLM
-        async with httpx.AsyncClient(timeout=None) as client:
-            async with client.stream(
-                "POST",
-                f"{OLLAMA_API_BASE_URL}/generate",
-                json={"model": model_name, "prompt": summary_prompt, "stream": True},
-            ) as response:
-                response.raise_for_status()
-                summary = ""
-                async for line in response.aiter_lines():
-                    if line:
-                        try:
-                            data = json.loads(line)
-                            chunk = data.get("response", "")
-                            if chunk:
-                                logger.debug(f"Received chunk from LLM: '{chunk}'")
-                                summary += chunk
-                                await asyncio.sleep(0)
-                        except json.JSONDecodeError:
-                            logger.error(f"Failed to decode JSON line: '{line}'")
-                logger.info(f"Summarization completed. Summary: '{summary.strip()}'")
-                return summary.strip()
+        async with ollama_client.stream(
+            "POST",
+            "/generate",
+            content=body,
+            headers=_JSON_HEADERS,
+            timeout=None,
+        ) as response:
+            response.raise_for_status()
+            started = False
+            pending = ""  # Whitespace held back until more text follows it
+            async for line in aiter_byte_lines(response):
+                try:
+                    chunk = decode_ollama_chunk(line).response
+                    text = chunk.rstrip()
+                    if text:
+                        logger.debug("Received chunk from LLM: %r", chunk)
+                        # Drop leading and trailing whitespace from the summary
+                        yield pending + text if started else text.lstrip()
+                        started = True
+                        pending = chunk[len(text):]
+                    elif started:
+                        pending += chunk
+                except msgspec.DecodeError:
+                    logger.error("Failed to decode JSON line: %r", line)
+            logger.info("Summarization completed.")
 
     except httpx.HTTPError as http_err:
-        logger.error(f"HTTP error during web search: {http_err}")
-        return "I couldn't retrieve information from the internet right now."
+        logger.error("HTTP error during web search: %s", http_err)
+        yield "I couldn't retrieve information from the internet right now."
     except Exception as e:
-        logger.error(f"Unexpected error during web search: {e}")
-        return "An error occurred while retrieving information."
+        logger.error("Unexpected error during web search: %s", e)
+        yield "An error occurred while retrieving information."
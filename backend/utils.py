@@ -1,18 +1,52 @@
 # backend/utils.py
 
 import logging
+from typing import AsyncIterator
+
+import httpx
+import msgspec
+
+from config import LOG_LEVEL
+
+class OllamaChunk(msgspec.Struct, gc=False):
+    """
+    A line of Ollama's streamed generate response. Only the generated text is decoded.
+    """
+    response: str = ""
+
+# Decodes a streamed line straight into an OllamaChunk
+decode_ollama_chunk = msgspec.json.Decoder(OllamaChunk).decode
+
+def configure_logging():
+    """
+    Configures a single root handler for the application. Call once at startup.
+    The root logger stays at WARNING so third-party libraries (e.g. httpx, which logs
+    request URLs including API keys) don't log at the application's level.
+    """
+    logging.basicConfig(
+        level=logging.WARNING,
+        format='%(asctime)s [%(levelname)s] %(name)s: %(message)s'
+    )
 
 def get_logger(name: str) -> logging.Logger:
     """
-    Configures and returns a logger.
+    Returns an application logger at LOG_LEVEL that propagates to the root handler.
     """
     logger = logging.getLogger(name)
-    if not logger.handlers:
-        logger.setLevel(logging.DEBUG)  # Set to DEBUG for detailed logs
-        handler = logging.StreamHandler()
-        formatter = logging.Formatter(
-            '%(asctime)s [%(levelname)s] %(name)s: %(message)s'
-        )
-        handler.setFormatter(formatter)
-        logger.addHandler(handler)
+    logger.setLevel(getattr(logging, LOG_LEVEL, logging.INFO))  # Set LOG_LEVEL=DEBUG for detailed logs
     return logger
+
+async def aiter_byte_lines(response: httpx.Response) -> AsyncIterator[bytes]:
+    """
+    Yields the non-empty lines of a streamed response as raw bytes, skipping str decoding.
+    """
+    buffer = bytearray()
+    async for chunk in response.aiter_bytes():
+        buffer += chunk
+        while (i := buffer.find(b"\n")) != -1:
+            line = bytes(buffer[:i])
+            del buffer[:i + 1]
+            if line:
+                yield line
+    if buffer:
+        yield bytes(buffer)